@@ -1,12 +1,18 @@
 #!/usr/bin/env python3
 
 import argparse
+import concurrent.futures
+import dataclasses
+import functools
+import itertools
+import operator
+import os
 import pathlib
+import re
+import sys
 import tomllib
 import typing
 
-from termcolor import cprint
-
 #TODO: fail gracefully if paths not present
 
 # provide your dsda_doom_data folder or equivalent here
@@ -28,23 +34,89 @@ PRINT_UNMAX_LVLS = True
 PRINT_UNPLAY_LVLS = True
 PRINT_ONCE_PER_WAD: bool
 
-TOTAL_MAXED_LVLS: int
-TOTAL_DEAD_DEMONS: int
-
 PWAD_INDENT_STRING = "    "
 
+def _colors_enabled():
+    #same enablement rules as termcolor: explicit environment overrides win,
+    #otherwise only color when stdout is an interactive terminal
+    if "ANSI_COLORS_DISABLED" in os.environ:
+        return False
+    if "NO_COLOR" in os.environ:
+        return False
+    if "FORCE_COLOR" in os.environ:
+        return True
+    return sys.stdout.isatty() and os.environ.get("TERM") != "dumb"
+
+#ANSI codes matching termcolor's palette, resolved once at import time
+#instead of per message (termcolor re-probes the environment on every call);
+#all empty strings when coloring is disabled
+if _colors_enabled():
+    _ANSI_CODES = {
+        "red": "\x1b[31m",
+        "light_yellow": "\x1b[93m",
+        "light_green": "\x1b[92m",
+        "light_blue": "\x1b[94m",
+    }
+    _ANSI_RESET = "\x1b[0m"
+else:
+    _ANSI_CODES = dict.fromkeys(("red", "light_yellow", "light_green", "light_blue"), "")
+    _ANSI_RESET = ""
+
+#output lines are collected per wad and flushed in one write at the end of
+#main(), instead of doing a small print syscall per level
+def format_line(text="", color=None):
+    if color:
+        return f"{_ANSI_CODES[color]}{text}{_ANSI_RESET}\n"
+    return text + "\n"
+
+#running totals, passed through the call chain instead of living in module
+#globals (locals are cheaper to access and this keeps check_max self-contained)
+@dataclasses.dataclass
+class Run_Totals:
+    maxed_lvls: int = 0
+    dead_demons: int = 0
+
+#preprocessed from the raw TOML lists so lookups are by hash instead of
+#a linear scan per level (see build_exceptions_table below)
 class Exceptions_Table(typing.NamedTuple):
-    WAD_EXCEPTIONS: list
-    KILL_EXCEPTIONS: list
-    SECRET_EXCEPTIONS: list
-    ITEM_EXCEPTIONS: list
-    PLAY_EXCEPTIONS: list
+    WAD_EXCEPTIONS: set #of (iwad, pwad) tuples
+    KILL_EXCEPTIONS: dict #of (iwad, pwad, lump) -> list of thresholds
+    SECRET_EXCEPTIONS: dict
+    ITEM_EXCEPTIONS: dict
+    PLAY_EXCEPTIONS: set #of (iwad, pwad, lump) tuples
+
+def _build_threshold_map(levels):
+    threshold_map = {}
+    for level in levels:
+        threshold_map.setdefault((level[0], level[1], level[2]), []).append(level[3])
+    return threshold_map
+
+def build_exceptions_table(exc_table_raw):
+    return Exceptions_Table(
+        WAD_EXCEPTIONS={(wad[0], wad[1]) for wad in exc_table_raw["WAD_EXCEPTIONS"]},
+        KILL_EXCEPTIONS=_build_threshold_map(exc_table_raw["KILL_EXCEPTIONS"]),
+        SECRET_EXCEPTIONS=_build_threshold_map(exc_table_raw["SECRET_EXCEPTIONS"]),
+        ITEM_EXCEPTIONS=_build_threshold_map(exc_table_raw["ITEM_EXCEPTIONS"]),
+        PLAY_EXCEPTIONS={(lvl[0], lvl[1], lvl[2]) for lvl in exc_table_raw["PLAY_EXCEPTIONS"]},
+    )
 
 #TODO: lift ALL printing behavior into its own distinct step
 # this will also make paginating output easier
 
-#ugly hack global to fix a bug since i'm kicking the can on that refactor
-SUPPRESS_PRINTING = False
+#matches every numeric field of a stat line in one C-level pass
+_INT_RE = re.compile(r"-?\d+")
+
+#indexes into the 14 numeric fields of a stat line (everything after the lump
+#name; see the format spec below). The parsing hot path works on the raw field
+#list instead of building a DSDA_Stat_Line per level, which is measurably
+#cheaper; the NamedTuple below stays as the readable form of the spec.
+_I_BEST_TIME = 3
+_I_BEST_KILLS = 8
+_I_BEST_ITEMS = 9
+_I_BEST_SECRETS = 10
+_I_MAX_KILLS = 11
+_I_MAX_ITEMS = 12
+_I_MAX_SECRETS = 13
 
 
 # currently only stats.txt version 1 is supported, described below
@@ -82,143 +154,186 @@ class DSDA_Stat_Line(typing.NamedTuple):
     max_items: int
     max_secrets: int
 
-    @property
-    def maxed(self) -> bool:
-        kill_max = self.best_kills == self.max_kills
-        secret_max = self.best_secrets == self.max_secrets
-        return kill_max and secret_max
-
-    @property
-    def item_maxed(self):
-        return self.best_items == self.max_items
 
-    @property
-    def triplet_id(self):
-        return [self.iwad, self.pwad, self.lump_name]
+def max_exception(exc_table, triplet, best_kills, best_secrets):
+    is_exception = False
+    for threshold in exc_table.KILL_EXCEPTIONS.get(triplet, ()):
+        if best_kills >= threshold:
+            is_exception = True
+    for threshold in exc_table.SECRET_EXCEPTIONS.get(triplet, ()):
+        if best_secrets >= threshold:
+            is_exception = True
+        else: #level should match BOTH exception criteria if present
+            is_exception = False
+    return is_exception
 
-    def max_exception(self, exc_table):
-        is_exception = False
-        for level in exc_table.KILL_EXCEPTIONS:
-            if self.triplet_id != level[:3]:
-                continue
-            if self.best_kills >= level[3]:
-                is_exception = True
-        for level in exc_table.SECRET_EXCEPTIONS:
-            if self.triplet_id != level[:3]:
-                continue
-            if self.best_secrets >= level[3]:
-                is_exception = True
-            else: #level should match BOTH exception criteria if present
-                is_exception = False
-        return is_exception
-
-    def item_exception(self, exc_table):
-        is_exception = False
-        for level in exc_table.ITEM_EXCEPTIONS:
-            if self.triplet_id != level[:3]:
-                continue
-            if self.best_items >= level[3]:
-                is_exception = True
-        return is_exception
+def item_exception(exc_table, triplet, best_items):
+    is_exception = False
+    for threshold in exc_table.ITEM_EXCEPTIONS.get(triplet, ()):
+        if best_items >= threshold:
+            is_exception = True
+    return is_exception
 
 
+@functools.lru_cache(maxsize=None) #the set of distinct (iwad, pwad) pairs is tiny
 def format_pwad(iwad, pwad):
     if pwad:
         return f"{pwad.upper()} (iwad {iwad.upper()})"
     return iwad.upper()
 
-def format_num_maps(num_maps):
-    if num_maps == 1:
-        s = ""
-    else:
-        s = "s"
-    return f"({num_maps} map{s})"
-
-def check_max(iwad, pwad, stat_line_raw, exc_table): #return whether the level is considered "maxed"
-    global TOTAL_MAXED_LVLS, TOTAL_DEAD_DEMONS
-    level = DSDA_Stat_Line(iwad, pwad, *stat_line_raw)
-    if level.triplet_id in exc_table.PLAY_EXCEPTIONS:
+def check_max(iwad, pwad, lump, numbers, exc_table, pwad_label, indent, totals, out): #return whether the level is considered "maxed"
+    #numbers is the raw list of 14 numeric field strings; only the fields we
+    #actually look at get converted (see the _I_* index constants)
+    triplet = (iwad, pwad, lump) #computed once, reused by every exception check
+    if triplet in exc_table.PLAY_EXCEPTIONS:
         return True #bail early to avoid counting completed PLAY_EXCEPTIONS levels
-    if level.best_time == -1: #level not finished
-        if PRINT_UNPLAY_LVLS and not SUPPRESS_PRINTING:
-            print(PWAD_INDENT_STRING if pwad else "", end="")
-            cprint(f"Level {level.lump_name} in {format_pwad(iwad, pwad)} isn't beaten!", UNPLAY_COLOR)
+    if numbers[_I_BEST_TIME] == "-1": #level not finished
+        if PRINT_UNPLAY_LVLS:
+            out.append(format_line(f"{indent}Level {lump} in {pwad_label} isn't beaten!", UNPLAY_COLOR))
         return False
-    TOTAL_DEAD_DEMONS += level.best_kills #not total kills, since that counts across multiple playthroughs
+    best_kills = int(numbers[_I_BEST_KILLS])
+    totals.dead_demons += best_kills #not total kills, since that counts across multiple playthroughs
     #TODO: reorganize these into a single if statement, prefer notifying missed kills to missed items
-    if REQUIRE_ITEMS and not level.item_maxed:
-        if not level.item_exception(exc_table):
-            if PRINT_UNMAX_LVLS and not SUPPRESS_PRINTING:
-                print(PWAD_INDENT_STRING if pwad else "", end="")
-                cprint(f"Level {level.lump_name} in {format_pwad(iwad, pwad)} is missing items!", UNMAX_COLOR)
-            return False
-    if not level.maxed:
-        if not level.max_exception(exc_table):
-            if PRINT_UNMAX_LVLS and not SUPPRESS_PRINTING:
-                print(PWAD_INDENT_STRING if pwad else "", end="")
-                cprint(f"Level {level.lump_name} in {format_pwad(iwad, pwad)} isn't maxed!", UNMAX_COLOR)
+    if REQUIRE_ITEMS:
+        best_items = int(numbers[_I_BEST_ITEMS])
+        if best_items != int(numbers[_I_MAX_ITEMS]):
+            if not item_exception(exc_table, triplet, best_items):
+                if PRINT_UNMAX_LVLS:
+                    out.append(format_line(f"{indent}Level {lump} in {pwad_label} is missing items!", UNMAX_COLOR))
+                return False
+    best_secrets = int(numbers[_I_BEST_SECRETS])
+    #and checks short-circuit, so the secret comparison is skipped when kills already fall short
+    level_maxed = best_kills == int(numbers[_I_MAX_KILLS]) and best_secrets == int(numbers[_I_MAX_SECRETS])
+    if not level_maxed:
+        if not max_exception(exc_table, triplet, best_kills, best_secrets):
+            if PRINT_UNMAX_LVLS:
+                out.append(format_line(f"{indent}Level {lump} in {pwad_label} isn't maxed!", UNMAX_COLOR))
             return False
-    TOTAL_MAXED_LVLS += 1
-    if PRINT_MAX_LVLS and not SUPPRESS_PRINTING: #TODO: prints even if the entire wad is maxed
-        print(PWAD_INDENT_STRING if pwad else "", end="")
-        cprint(f"Level {level.lump_name} in {format_pwad(iwad, pwad)} is maxed!", MAX_COLOR)
+    totals.maxed_lvls += 1
+    if PRINT_MAX_LVLS: #TODO: prints even if the entire wad is maxed
+        out.append(format_line(f"{indent}Level {lump} in {pwad_label} is maxed!", MAX_COLOR))
     return True
 
+def tally_remaining(stat_lines, start, iwad, pwad, exc_table, totals):
+    #lean version of the check_max loop for when nothing more gets printed for
+    #this wad: same totals bookkeeping, but no message formatting and no
+    #DSDA_Stat_Line construction, and only the fields we need get converted
+    #hoist the globals and table lookups out of the per-line loop
+    require_items = REQUIRE_ITEMS
+    play_exceptions = exc_table.PLAY_EXCEPTIONS
+    find_ints = _INT_RE.findall
+    for line in itertools.islice(stat_lines, start, None):
+        parts = line.split(maxsplit=1)
+        if len(parts) != 2:
+            continue
+        numbers = find_ints(parts[1])
+        if len(numbers) != 14:
+            continue
+        triplet = (iwad, pwad, parts[0])
+        if triplet in play_exceptions:
+            continue
+        if numbers[_I_BEST_TIME] == "-1": #level not finished
+            continue
+        best_kills = int(numbers[_I_BEST_KILLS])
+        totals.dead_demons += best_kills
+        best_items = int(numbers[_I_BEST_ITEMS])
+        best_secrets = int(numbers[_I_BEST_SECRETS])
+        if require_items and best_items != int(numbers[_I_MAX_ITEMS]):
+            if not item_exception(exc_table, triplet, best_items):
+                continue
+        if best_kills == int(numbers[_I_MAX_KILLS]) and best_secrets == int(numbers[_I_MAX_SECRETS]):
+            totals.maxed_lvls += 1
+        elif max_exception(exc_table, triplet, best_kills, best_secrets):
+            totals.maxed_lvls += 1
+
 def parse_stats(path, iwad, pwad, exc_table):
+    #returns this wad's totals and its buffered output lines, so wads can be
+    #parsed on worker threads and printed in order afterwards
+    totals = Run_Totals()
+    out = []
     # Refer to stats.txt format spec above, near the definition of DSDA_Stat_Line
-    global SUPPRESS_PRINTING
-    with open(path, 'r', encoding="utf-8") as stat_file:
-        stats_ver = stat_file.readline()
-        _ = stat_file.readline()
-        stat_list = stat_file.readlines()
-    #stats files should never be very long, so it's fine to just dump them into RAM like that
+    #read the whole file in one unbuffered gulp; stats files should never be very long,
+    #so it's fine to just dump them into RAM like that, and skipping BufferedReader +
+    #TextIOWrapper saves a few syscalls per file (the contents are all ASCII anyway)
+    with open(path, 'rb', buffering=0) as stat_file:
+        raw_stats = stat_file.read()
+    stat_lines = raw_stats.decode("ascii").splitlines()
+    stats_ver = stat_lines[0] if stat_lines else "" #empty file reads as an unsupported version
+    #stat_lines[1] is the total kill count, which we don't use; the stat lines
+    #proper start at index 2, iterated in place rather than sliced into a copy
+    #format once per wad instead of once per message (saves the .upper() calls too)
+    pwad_label = format_pwad(iwad, pwad)
+    indent = PWAD_INDENT_STRING if pwad else ""
     if stats_ver.strip() != "1":
-        raise RuntimeError(f"Unsupported stats.txt version {stats_ver.strip()} found in {format_pwad(iwad, pwad)}")
+        raise RuntimeError(f"Unsupported stats.txt version {stats_ver.strip()} found in {pwad_label}")
     wad_max = True
-    for line in stat_list: #todo: check skill?
-        stats = line.split()
-        stats[1:] = [int(stat) for stat in stats[1:]] #convert all but the first value into ints
-        assert len(stats) == 15
-        if not check_max(iwad, pwad, stats, exc_table):
+    #hoist the per-loop global reads into locals (they never change after argparse)
+    print_once_per_wad = PRINT_ONCE_PER_WAD
+    find_ints = _INT_RE.findall
+    for line_num, line in enumerate(itertools.islice(stat_lines, 2, None), start=2): #todo: check skill?
+        parts = line.split(maxsplit=1) #just peel off the lump name
+        if len(parts) != 2: #skip blank or otherwise malformed lines
+            continue
+        #one regex pass grabs all 14 numeric fields at once
+        numbers = find_ints(parts[1])
+        if len(numbers) != 14:
+            continue
+        if not check_max(iwad, pwad, parts[0], numbers, exc_table, pwad_label, indent, totals, out):
             wad_max = False
-            if PRINT_ONCE_PER_WAD:
-                SUPPRESS_PRINTING = True
+            if print_once_per_wad:
+                #nothing more gets printed for this wad, so just total up the
+                #rest of the levels without the formatting overhead
+                tally_remaining(stat_lines, line_num + 1, iwad, pwad, exc_table, totals)
+                break
     if wad_max and PRINT_MAX_WADS:
-        num_maps = len(stat_list)
-        print(PWAD_INDENT_STRING if pwad else "", end="")
-        cprint(f"*** Well done! {format_pwad(iwad, pwad)} is completely maxed! {format_num_maps(num_maps)} ***", MAX_COLOR)
-
-def parse_path(path, exc_table):
-    local_path = path.relative_to(ROOT_PATH)
-    path_parts = local_path.parts
-    iwad = path_parts[0]
-    if len(path_parts) > 2: #NOTE: this assumes the pwad is directly under the iwad (might lean on this for MASTERLEVELS.WAD)
-        pwad = path_parts[1]
-    else:
-        pwad = ""
-    if [iwad, pwad] in exc_table.WAD_EXCEPTIONS:
-        return #completely ignore
-    parse_stats(path, iwad, pwad, exc_table)
+        num_maps = max(len(stat_lines) - 2, 0) #don't go negative on header-only files
+        #'s'[:num_maps != 1] is "s" unless num_maps is exactly 1
+        out.append(format_line(f"{indent}*** Well done! {pwad_label} is completely maxed! ({num_maps} map{'s'[:num_maps != 1]}) ***", MAX_COLOR))
+    return totals, out
+
+def parse_path(path, iwad, pwad, exc_table):
+    if (iwad, pwad) in exc_table.WAD_EXCEPTIONS:
+        return Run_Totals(), [] #completely ignore
+    totals, out = parse_stats(path, iwad, pwad, exc_table)
     #TODO: if PRINT_ONCE_PER_WAD, then put blank lines between iwads, otherwise, put *two* blank lines between iwads
     if not PRINT_ONCE_PER_WAD:
-        print() #when printing big level lists, put blank lines between wads
+        out.append(format_line()) #when printing big level lists, put blank lines between wads
+    return totals, out
 
-def _path_sort_key(path):
-    local_path_parts = path.relative_to(ROOT_PATH).parts
-    if len(local_path_parts) == 2: #iwads should sort before pwads
-        local_path_parts = (local_path_parts[0], "", local_path_parts[1])
-    return local_path_parts
+def _scan_stats(root, iwad="", pwad="", depth=0):
+    #os.scandir is much cheaper than rglob here: DirEntry caches the stat info,
+    #and tracking (iwad, pwad) during the walk saves a relative_to() per file
+    #NOTE: this assumes the pwad is directly under the iwad (might lean on this for MASTERLEVELS.WAD)
+    with os.scandir(root) as entries:
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                if depth == 0:
+                    yield from _scan_stats(entry.path, entry.name, "", 1)
+                elif depth == 1:
+                    yield from _scan_stats(entry.path, iwad, entry.name, 2)
+                else:
+                    yield from _scan_stats(entry.path, iwad, pwad, depth + 1)
+            elif entry.name == "stats.txt" and entry.is_file():
+                yield (entry.path, iwad, pwad)
 
 def main():
-    global SUPPRESS_PRINTING
     with open(EXCEPTIONS_FILE, 'rb') as exc_file:
         exc_table_raw = tomllib.load(exc_file)
-    exc_table = Exceptions_Table(**exc_table_raw)
-    for path in sorted(ROOT_PATH.rglob("stats.txt"), key=_path_sort_key):
-        SUPPRESS_PRINTING = False #may have been enabled if PRINT_ONCE_PER_WAD
-        parse_path(path, exc_table)
-    cprint(f"Total maps maxed: {TOTAL_MAXED_LVLS}", TOTALS_COLOR)
-    cprint(f"Total dead demons: {TOTAL_DEAD_DEMONS}", TOTALS_COLOR)
+    exc_table = build_exceptions_table(exc_table_raw)
+    #iwads sort before pwads since the bare iwad's pwad field is ""
+    found = sorted(_scan_stats(ROOT_PATH), key=operator.itemgetter(1, 2))
+    totals = Run_Totals()
+    out_lines = []
+    #each stats.txt is independent, so overlap the file reads across threads;
+    #executor.map preserves the sorted order, so output stays deterministic
+    with concurrent.futures.ThreadPoolExecutor(max_workers=8) as executor:
+        for wad_totals, out in executor.map(lambda args: parse_path(*args, exc_table), found):
+            totals.maxed_lvls += wad_totals.maxed_lvls
+            totals.dead_demons += wad_totals.dead_demons
+            out_lines.extend(out)
+    out_lines.append(format_line(f"Total maps maxed: {totals.maxed_lvls}", TOTALS_COLOR))
+    out_lines.append(format_line(f"Total dead demons: {totals.dead_demons}", TOTALS_COLOR))
+    sys.stdout.write("".join(out_lines))
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(
@@ -230,6 +345,4 @@ if __name__ == "__main__":
     args = parser.parse_args()
     PRINT_ONCE_PER_WAD = args.verbose
     REQUIRE_ITEMS = args.items
-    TOTAL_MAXED_LVLS = 0
-    TOTAL_DEAD_DEMONS = 0
     main()